@@ -0,0 +1,202 @@
+import json
+import os
+
+import numpy as np
+
+INDEX_ARRAYS = ("names", "offsets", "centers", "sizes", "classes")
+
+
+def default_index_dir(labels_dir):
+    """
+    Folder of the index compiled from `labels_dir`, next to it like the
+    `labels/<split>.cache` files written by YOLO (e.g. `labels/train.index/`).
+
+    :param labels_dir: Folder containing the YOLO .txt label files
+    :return: Path of the index folder
+    """
+    return os.path.normpath(labels_dir) + ".index"
+
+
+def scan_label_files(labels_dir):
+    """
+    List the label files of a folder with their modification times.
+
+    :param labels_dir: Folder containing the YOLO .txt label files
+    :return: Dict mapping each label file stem to its mtime in nanoseconds
+    """
+    with os.scandir(labels_dir) as entries:
+        return {
+            entry.name[:-4]: entry.stat().st_mtime_ns
+            for entry in entries
+            if entry.name.endswith(".txt") and entry.is_file()
+        }
+
+
+def read_label_file(label_path):
+    """
+    Parse a YOLO label file into an array.
+
+    Extra columns (e.g. confidences saved with predictions) are dropped.
+
+    :param label_path: Path to the YOLO .txt label file
+    :return: (N, 5) array of (class, x_center, y_center, width, height) rows
+    """
+    with open(label_path, "r") as f:
+        rows = [line.split()[:5] for line in f if line.strip()]
+    return np.array(rows, dtype=np.float64).reshape(-1, 5)
+
+
+class AnnotationIndex:
+    """
+    Annotations of one split stored as contiguous arrays.
+
+    The annotations of the i-th image are the rows offsets[i]:offsets[i + 1]
+    of `centers`, `sizes` and `classes`. Coordinates are normalized as in the
+    YOLO label files.
+    """
+
+    def __init__(self, names, offsets, centers, sizes, classes):
+        self.names = names
+        self.offsets = offsets
+        self.centers = centers
+        self.sizes = sizes
+        self.classes = classes
+        self._positions = {str(name): i for i, name in enumerate(names)}
+
+    @classmethod
+    def load(cls, labels_dir, index_dir=None):
+        """
+        Memory-map the index of a label folder, compiling it first if it is
+        missing or if any label file was added, removed or modified since.
+
+        :param labels_dir: Folder containing the YOLO .txt label files
+        :param index_dir: Folder of the index, defaults to default_index_dir
+        :return: AnnotationIndex
+        """
+        if index_dir is None:
+            index_dir = default_index_dir(labels_dir)
+        label_mtimes = scan_label_files(labels_dir)
+        manifest_path = os.path.join(index_dir, "manifest.json")
+        try:
+            with open(manifest_path, "r") as f:
+                up_to_date = json.load(f)["label_mtimes"] == label_mtimes
+        except (OSError, ValueError, KeyError):
+            up_to_date = False
+        if not up_to_date:
+            cls.build(labels_dir, index_dir, label_mtimes)
+
+        arrays = [
+            np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r")
+            for name in INDEX_ARRAYS
+        ]
+        return cls(*arrays)
+
+    @staticmethod
+    def build(labels_dir, index_dir=None, label_mtimes=None):
+        """
+        Compile the label files of a folder into an index.
+
+        :param labels_dir: Folder containing the YOLO .txt label files
+        :param index_dir: Folder of the index, defaults to default_index_dir
+        :param label_mtimes: Output of scan_label_files, rescanned if None
+        """
+        if index_dir is None:
+            index_dir = default_index_dir(labels_dir)
+        if label_mtimes is None:
+            label_mtimes = scan_label_files(labels_dir)
+
+        names = sorted(label_mtimes)
+        rows = [
+            read_label_file(os.path.join(labels_dir, name + ".txt")) for name in names
+        ]
+        offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum([len(r) for r in rows], out=offsets[1:])
+        rows = np.concatenate(rows) if rows else np.zeros((0, 5))
+
+        AnnotationIndex.save(
+            index_dir,
+            names,
+            offsets,
+            rows[:, 1:3],
+            rows[:, 3:5],
+            rows[:, 0],
+            label_mtimes,
+        )
+
+    @staticmethod
+    def save(index_dir, names, offsets, centers, sizes, classes, label_mtimes):
+        """
+        Save an index as one .npy file per array, plus a manifest holding the
+        label file mtimes it was compiled from.
+
+        :param index_dir: Output folder
+        :param names: Image names (label file stems), one per image
+        :param offsets: (num_images + 1,) array of annotation offsets
+        :param centers: (num_annotations, 2) array of normalized (x, y) centres
+        :param sizes: (num_annotations, 2) array of normalized (width, height)
+        :param classes: (num_annotations,) array of class ids
+        :param label_mtimes: Output of scan_label_files for the label folder
+        """
+        os.makedirs(index_dir, exist_ok=True)
+        manifest_path = os.path.join(index_dir, "manifest.json")
+        # The manifest marks the index as valid, so it goes last
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+
+        arrays = {
+            "names": np.asarray(names, dtype=str),
+            "offsets": np.asarray(offsets, dtype=np.int64),
+            "centers": np.asarray(centers, dtype=np.float64).reshape(-1, 2),
+            "sizes": np.asarray(sizes, dtype=np.float64).reshape(-1, 2),
+            "classes": np.asarray(classes, dtype=np.int32),
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(index_dir, f"{name}.npy"), array)
+
+        with open(manifest_path, "w") as f:
+            json.dump({"label_mtimes": label_mtimes}, f)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._positions
+
+    def _rows(self, name):
+        i = self._positions[name]
+        return slice(self.offsets[i], self.offsets[i + 1])
+
+    def counts(self):
+        """
+        :return: Number of annotations of each image, in the order of `names`
+        """
+        return np.diff(self.offsets)
+
+    def counts_by_name(self):
+        """
+        :return: Dict mapping each image name to its number of annotations
+        """
+        return dict(zip(map(str, self.names), self.counts().tolist()))
+
+    def points(self, name, image_width, image_height):
+        """
+        Centres of the annotations of an image in pixel coordinates.
+
+        :param name: Image name
+        :param image_width: Width of the image
+        :param image_height: Height of the image
+        :return: (N, 3) integer array of (x, y, class) rows
+        """
+        rows = self._rows(name)
+        points = np.empty((rows.stop - rows.start, 3), dtype=np.int64)
+        points[:, :2] = self.centers[rows] * (image_width, image_height)
+        points[:, 2] = self.classes[rows]
+        return points
+
+    def boxes(self, name):
+        """
+        :param name: Image name
+        :return: (N, 4) array of normalized (x_center, y_center, width, height)
+        """
+        rows = self._rows(name)
+        return np.concatenate((self.centers[rows], self.sizes[rows]), axis=1)
@@ -0,0 +1,327 @@
+import importlib
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+import torch
+from PIL import Image, ImageDraw
+
+from annotation_index import AnnotationIndex
+from unet_smp import (
+    CornKernelDataModule,
+    CornKernelDataset,
+    JointTransform,
+    UNetLightningModule,
+)
+
+density_maps = importlib.import_module("density-maps")
+
+
+def make_synthetic_sample(rng, image_size, num_kernels):
+    """
+    Draw a synthetic ear of corn: kernel-sized ellipses on a plain background.
+
+    :param rng: numpy random Generator
+    :param image_size: Tuple of (width, height) of the image
+    :param num_kernels: Number of kernels to draw
+    :return: PIL image and (num_kernels, 5) array of YOLO label rows
+    """
+    width, height = image_size
+    image = Image.new("RGB", image_size, (40, 35, 30))
+    draw = ImageDraw.Draw(image)
+
+    sizes = rng.uniform(0.005, 0.03, size=(num_kernels, 2))
+    centers = rng.uniform(sizes, 1 - sizes)
+    colors = rng.integers(150, 255, size=(num_kernels, 3))
+    for (x, y), (w, h), color in zip(centers, sizes, colors):
+        box = [
+            (x - w / 2) * width,
+            (y - h / 2) * height,
+            (x + w / 2) * width,
+            (y + h / 2) * height,
+        ]
+        draw.ellipse(box, fill=tuple(int(c) for c in color))
+
+    labels = np.column_stack((np.zeros(num_kernels), centers, sizes))
+    return image, labels
+
+
+def make_synthetic_dataset(data_dir, num_images, image_size, sigma, seed=0):
+    """
+    Write a synthetic split laid out like the corn kernel datasets: images and
+    density maps in one folder, YOLO labels in another.
+
+    Kernel counts are drawn to roughly match the Base dataset (median ~200,
+    up to ~800 kernels per image).
+
+    :param data_dir: Output folder
+    :param num_images: Number of images
+    :param image_size: Tuple of (width, height) of the images
+    :param sigma: Standard deviation for the density map Gaussian kernel
+    :param seed: Random seed
+    :return: Tuple of (image/density map folder, labels folder)
+    """
+    rng = np.random.default_rng(seed)
+    image_dir = os.path.join(data_dir, "images")
+    labels_dir = os.path.join(data_dir, "labels")
+    os.makedirs(image_dir, exist_ok=True)
+    os.makedirs(labels_dir, exist_ok=True)
+
+    counts = np.clip(rng.normal(220, 150, size=num_images), 1, 800).astype(int)
+    for i, count in enumerate(counts):
+        name = f"corn_{i:03d}"
+        image, labels = make_synthetic_sample(rng, image_size, count)
+        image.save(os.path.join(image_dir, name + ".jpg"))
+        np.savetxt(
+            os.path.join(labels_dir, name + ".txt"), labels, fmt="%d %g %g %g %g"
+        )
+
+    annotation_index = AnnotationIndex.load(labels_dir)
+    width, height = image_size
+    for name in annotation_index.names:
+        density_map = density_maps.create_density_map(
+            (height, width), annotation_index.points(name, width, height), sigma
+        )
+        np.save(os.path.join(image_dir, f"{name}_class_0_density.npy"), density_map)
+
+    return image_dir, labels_dir
+
+
+def setup_create_density_map(image_dir, labels_dir, config):
+    width, height = config["image_size"]
+    annotation_index = AnnotationIndex.load(labels_dir)
+    points = annotation_index.points(annotation_index.names[0], width, height)
+
+    def run():
+        density_maps.create_density_map((height, width), points, config["sigma"])
+
+    return run, 1
+
+
+def setup_annotation_counts(image_dir, labels_dir, config):
+    # The count helpers of the notebooks, with the index already compiled
+    AnnotationIndex.load(labels_dir)
+
+    def run():
+        AnnotationIndex.load(labels_dir).counts_by_name()
+
+    return run, 1
+
+
+def setup_joint_transform(image_dir, labels_dir, config):
+    transform = training_transform(image_dir)
+    dataset = CornKernelDataset(image_dir, image_dir)
+    image, density_map = dataset[0]
+    joint_transforms = [
+        t for t in transform.transforms if isinstance(t, JointTransform)
+    ]
+
+    def run():
+        x, y = image, density_map
+        for t in joint_transforms:
+            x, y = t(x, y)
+
+    return run, 1
+
+
+def setup_dataset_getitem(image_dir, labels_dir, config):
+    dataset = CornKernelDataset(
+        image_dir, image_dir, transform=training_transform(image_dir)
+    )
+    idx = itertools.count()
+
+    def run():
+        dataset[next(idx) % len(dataset)]
+
+    return run, 1
+
+
+def setup_unet_forward(image_dir, labels_dir, config):
+    model = UNetLightningModule(
+        in_channels=3,
+        out_channels=1,
+        decoder_channels=(512, 256, 128, 64, 32),
+        learning_rate=1e-4,
+        encoder_weights=None,  # Random weights run as fast and need no download
+    ).eval()
+    x = torch.rand(config["batch_size"], 3, 480, 640)
+
+    def run():
+        with torch.no_grad():
+            model(x)
+
+    return run, config["batch_size"]
+
+
+def setup_validation_step(image_dir, labels_dir, config):
+    # The count error and loss evaluated on every validation batch
+    model = UNetLightningModule(
+        in_channels=3,
+        out_channels=1,
+        decoder_channels=(512, 256, 128, 64, 32),
+        learning_rate=1e-4,
+        encoder_weights=None,
+    ).eval()
+    x = torch.rand(config["batch_size"], 3, 480, 640)
+    # About 220 kernels per map, at 100 per kernel like the density maps
+    y = torch.rand(config["batch_size"], 1, 480, 640)
+    y = y / y.sum(dim=(1, 2, 3), keepdim=True) * 220 * 100
+    # self.log only warns without a Trainer, which is not what is timed here
+    warnings.filterwarnings("ignore", message=".*self.log.*")
+
+    def run():
+        with torch.no_grad():
+            model.validation_step((x, y), 0)
+
+    return run, config["batch_size"]
+
+
+def training_transform(image_dir):
+    data_module = CornKernelDataModule(1, 0, image_dir, image_dir, image_dir, image_dir)
+    return data_module.transform
+
+
+STAGES = {
+    "create_density_map": setup_create_density_map,
+    "annotation_counts": setup_annotation_counts,
+    "joint_transform": setup_joint_transform,
+    "dataset_getitem": setup_dataset_getitem,
+    "unet_forward": setup_unet_forward,
+    "validation_step": setup_validation_step,
+}
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def run_stage(stage, image_dir, labels_dir, config):
+    """
+    Time one stage. Runs in a fresh process so that the peak RSS is the
+    stage's own. RSS values are relative to the RSS after the imports, which
+    is reported as baseline_rss_mb.
+
+    :return: Dict of throughput, latency percentiles and peak RSS
+    """
+    baseline_rss = peak_rss_mb()
+    np.random.seed(config["seed"])
+    torch.manual_seed(config["seed"])
+    torch.set_num_threads(config["num_threads"])
+
+    run, items_per_call = STAGES[stage](image_dir, labels_dir, config)
+    setup_rss = peak_rss_mb()
+    for _ in range(config["warmup"]):
+        run()
+
+    latencies = []
+    for _ in range(config["iterations"]):
+        start = time.perf_counter()
+        run()
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000
+
+    return {
+        "iterations": config["iterations"],
+        "throughput": items_per_call * len(latencies) / latencies.sum() * 1000,
+        "latency_mean_ms": float(latencies.mean()),
+        "latency_p50_ms": float(np.percentile(latencies, 50)),
+        "latency_p90_ms": float(np.percentile(latencies, 90)),
+        "latency_p99_ms": float(np.percentile(latencies, 99)),
+        "baseline_rss_mb": baseline_rss,
+        "setup_rss_mb": setup_rss - baseline_rss,
+        "peak_rss_mb": peak_rss_mb() - baseline_rss,
+    }
+
+
+def run_benchmarks(config, stages=None):
+    """
+    Run the benchmark stages on a synthetic dataset, each in its own process.
+
+    :param config: Benchmark configuration, see __main__
+    :param stages: Names of the stages to run, defaults to all of STAGES
+    :return: Dict of results per stage
+    """
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    with tempfile.TemporaryDirectory() as data_dir:
+        image_dir, labels_dir = make_synthetic_dataset(
+            data_dir,
+            config["num_images"],
+            config["image_size"],
+            config["sigma"],
+            config["seed"],
+        )
+        for stage in stages or STAGES:
+            print(f"Benchmarking {stage}")
+            with context.Pool(1) as pool:
+                results[stage] = pool.apply(
+                    run_stage, (stage, image_dir, labels_dir, config)
+                )
+    return results
+
+
+def print_results(results):
+    # Peak RSS above the RSS after the imports, i.e. the stage's own
+    print(
+        f"{'stage':<20} {'items/s':>10} {'p50 ms':>10} {'p90 ms':>10} "
+        f"{'p99 ms':>10} {'stage RSS MB':>12}"
+    )
+    for stage, result in results.items():
+        print(
+            f"{stage:<20} {result['throughput']:>10.2f} "
+            f"{result['latency_p50_ms']:>10.2f} {result['latency_p90_ms']:>10.2f} "
+            f"{result['latency_p99_ms']:>10.2f} {result['peak_rss_mb']:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    root_dir = "../"
+    config = {
+        # Synthetic data, sized like the Base dataset images
+        "num_images": 8,
+        "image_size": (1920, 1280),
+        "sigma": 12,
+        # Timing
+        "iterations": 20,
+        "warmup": 2,
+        "batch_size": 2,
+        "num_threads": 4,
+        "seed": 0,
+    }
+    output_dir = f"{root_dir}logs/benchmarks/"
+
+    results = run_benchmarks(config)
+    print_results(results)
+
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(
+        output_dir, f"benchmark-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    with open(output_path, "w") as f:
+        json.dump(
+            {
+                "config": config,
+                "environment": {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "processor": platform.processor(),
+                    "cpu_count": os.cpu_count(),
+                    "numpy": np.__version__,
+                    "torch": torch.__version__,
+                },
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Saved results to {output_path}")
@@ -0,0 +1,215 @@
+import json
+import os
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from annotation_index import AnnotationIndex, default_index_dir, scan_label_files
+
+
+def iter_coco_sections(json_path, sections, chunk_size=1 << 20):
+    """
+    Stream the elements of some top-level arrays (e.g. "annotations") of a
+    COCO JSON file without loading the whole file into memory.
+
+    Elements of the other top-level arrays are decoded one at a time and
+    discarded, so memory use is bounded by the largest single element.
+
+    :param json_path: Path to the COCO JSON file
+    :param sections: Names of the top-level keys to stream
+    :param chunk_size: Number of characters read from disk at a time
+    :return: Generator over (section, element) tuples, in file order
+    """
+    decoder = json.JSONDecoder()
+    with open(json_path, "r", encoding="utf-8") as f:
+        buf = ""
+        pos = 0
+        eof = False
+
+        def fill():
+            nonlocal buf, pos, eof
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+            buf = buf[pos:] + chunk
+            pos = 0
+
+        def skip_whitespace():
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in " \t\n\r":
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return
+                fill()
+
+        def expect(chars):
+            nonlocal pos
+            skip_whitespace()
+            if pos >= len(buf) or buf[pos] not in chars:
+                found = buf[pos] if pos < len(buf) else "end of file"
+                raise ValueError(f"Expected one of {chars!r}, found {found!r}")
+            pos += 1
+            return buf[pos - 1]
+
+        def decode_value():
+            nonlocal pos
+            skip_whitespace()
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                    # A value ending exactly at the buffer end may be truncated
+                    if end < len(buf) or eof:
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                fill()
+
+        expect("{")
+        skip_whitespace()
+        if buf.startswith("}", pos):
+            return
+        while True:
+            key = decode_value()
+            expect(":")
+            skip_whitespace()
+            if buf.startswith("[", pos):
+                pos += 1
+                skip_whitespace()
+                if buf.startswith("]", pos):
+                    pos += 1
+                else:
+                    while True:
+                        element = decode_value()
+                        if key in sections:
+                            yield key, element
+                        if expect(",]") == "]":
+                            break
+            else:
+                decode_value()
+            if expect(",}") == "}":
+                return
+
+
+def _write_label_file(label_path, rows):
+    with open(label_path, "w") as f:
+        for row in rows:
+            line = "%d %g %g %g %g" % tuple(row)
+            f.write(line + "\n")
+            # Round the row in place to the precision written, for the index
+            row[1:] = [float(v) for v in line.split()[1:]]
+
+
+def convert_coco_to_yolo(
+    json_path,
+    labels_dir,
+    class_names=("Kernel",),
+    index_dir=None,
+    num_workers=8,
+):
+    """
+    Convert a COCO JSON file into one YOLO label file per image.
+
+    The JSON is streamed in two passes (images and categories first, then
+    annotations, which COCO files usually list before the categories), so only
+    the kept boxes are held in memory, as compact arrays. Annotations whose
+    category is not in `class_names` are dropped and the kept categories are
+    re-assigned zero-based class ids in the order of `class_names`.
+
+    :param json_path: Path to the COCO JSON file
+    :param labels_dir: Output folder for the YOLO .txt label files
+    :param class_names: Names of the COCO categories to keep
+    :param index_dir: Output folder for the annotation index, defaults to
+        default_index_dir(labels_dir)
+    :param num_workers: Number of threads writing label files
+    :return: Number of annotations written
+    """
+    images = {}
+    names = []
+    image_sizes = []
+    category_map = {}
+    for section, element in iter_coco_sections(json_path, ("images", "categories")):
+        if section == "images":
+            images[element["id"]] = len(names)
+            names.append(os.path.splitext(os.path.basename(element["file_name"]))[0])
+            image_sizes.append((element["width"], element["height"]))
+        elif element["name"] in class_names:
+            category_map[element["id"]] = class_names.index(element["name"])
+    missing = set(class_names) - {class_names[c] for c in category_map.values()}
+    if missing:
+        raise ValueError(f"Categories not found in {json_path}: {sorted(missing)}")
+
+    image_idx = array("i")
+    classes = array("i")
+    boxes = array("d")
+    for _, annotation in iter_coco_sections(json_path, ("annotations",)):
+        if annotation.get("iscrowd", 0):
+            continue
+        if annotation["category_id"] not in category_map:
+            continue
+        x, y, w, h = annotation["bbox"]
+        if w <= 0 or h <= 0:
+            continue
+        idx = images[annotation["image_id"]]
+        width, height = image_sizes[idx]
+        image_idx.append(idx)
+        classes.append(category_map[annotation["category_id"]])
+        boxes.extend(
+            ((x + w / 2) / width, (y + h / 2) / height, w / width, h / height)
+        )
+
+    # Group the annotations by image, keeping their order within each image
+    image_idx = np.frombuffer(image_idx, dtype=np.int32)
+    order = np.argsort(image_idx, kind="stable")
+    classes = np.frombuffer(classes, dtype=np.int32)[order]
+    boxes = np.frombuffer(boxes, dtype=np.float64).reshape(-1, 4)[order]
+    offsets = np.zeros(len(names) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(image_idx, minlength=len(names)), out=offsets[1:])
+
+    os.makedirs(labels_dir, exist_ok=True)
+    rows = np.column_stack((classes, boxes))
+    del boxes
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = [
+            executor.submit(
+                _write_label_file,
+                os.path.join(labels_dir, name + ".txt"),
+                rows[offsets[i] : offsets[i + 1]],
+            )
+            for i, name in enumerate(names)
+        ]
+        for future in futures:
+            future.result()
+
+    # Save the annotation index in the same pass from the rows as written, so
+    # it matches one compiled from the label files. If the folder holds other
+    # label files, it is compiled on first load instead
+    label_mtimes = scan_label_files(labels_dir)
+    if label_mtimes.keys() == set(names):
+        AnnotationIndex.save(
+            index_dir if index_dir is not None else default_index_dir(labels_dir),
+            names,
+            offsets,
+            rows[:, 1:3],
+            rows[:, 3:5],
+            classes,
+            label_mtimes,
+        )
+
+    return len(classes)
+
+
+if __name__ == "__main__":
+    stub_list = ["train", "val", "test"]
+    class_names = ("Kernel",)
+
+    for stub in stub_list:
+        json_path = f"../datasets/corn_kernel_coco/{stub}.json"
+        labels_dir = f"../datasets/corn_kernel_yolo/labels/{stub}/"
+
+        print(f"Converting {json_path}")
+        num_annotations = convert_coco_to_yolo(json_path, labels_dir, class_names)
+        print(f"Wrote {num_annotations} annotations to {labels_dir}")
@@ -5,26 +5,9 @@ import numpy as np
 from PIL import Image
 from scipy.ndimage import gaussian_filter
 
-# from pycocotools.coco import COCO
-
-
-def read_yolo_annotations(annotation_file, image_width, image_height):
-    """
-    Read YOLO format annotations and convert to pixel coordinates.
+from annotation_index import AnnotationIndex
 
-    :param annotation_file: Path to YOLO annotation file
-    :param image_width: Width of the image
-    :param image_height: Height of the image
-    :return: List of (x, y, class) tuples
-    """
-    points = []
-    with open(annotation_file, "r") as f:
-        for line in f:
-            class_id, x_center, y_center, _, _ = map(float, line.strip().split())
-            x = int(x_center * image_width)
-            y = int(y_center * image_height)
-            points.append((x, y, int(class_id)))
-    return points
+# from pycocotools.coco import COCO
 
 
 def create_density_map(image_shape, points, sigma=10, min_value=1e-4):
@@ -32,14 +15,13 @@ def create_density_map(image_shape, points, sigma=10, min_value=1e-4):
     Create a density map from point annotations.
 
     :param image_shape: Tuple of (height, width) of the image
-    :param points: List of (x, y, class) tuples
+    :param points: (N, 3) integer array of (x, y, class) rows
     :param sigma: Standard deviation for Gaussian kernel
     :return: Density map as a 2D numpy array
     """
     density_map = np.zeros(image_shape, dtype=np.float32)
 
-    for x, y, _ in points:
-        density_map[y, x] = 100
+    density_map[points[:, 1], points[:, 0]] = 100
 
     density_map = gaussian_filter(density_map, sigma=sigma, mode="constant")
 
@@ -57,16 +39,15 @@ def create_class_specific_density_maps(image_shape, points, class_labels, sigma=
     Create separate density maps for each class.
 
     :param image_shape: Tuple of (height, width) of the image
-    :param points: List of (x, y, class) tuples
-    :param num_classes: Number of classes in the dataset
+    :param points: (N, 3) integer array of (x, y, class) rows
+    :param class_labels: Class ids to create density maps for
     :param sigma: Standard deviation for Gaussian kernel
     :return: List of density maps, one for each class
     """
     class_density_maps = []
 
     for class_id in class_labels:
-        class_points = [(x, y, c) for x, y, c in points if c == class_id]
-        # print(class_points)
+        class_points = points[points[:, 2] == class_id]
         class_map = create_density_map(image_shape, class_points, sigma)
         class_density_maps.append(class_map)
 
@@ -104,18 +85,19 @@ def process_images(
     resize,
     target_size=(256, 256),
     sigma=10,
+    index_dir=None,
 ):
     os.makedirs(output_map_folder, exist_ok=True)
     os.makedirs(output_image_folder, exist_ok=True)
 
+    annotation_index = AnnotationIndex.load(annotation_folder, index_dir)
+
     for filename in os.listdir(image_folder):
         if filename.lower().endswith((".png", ".jpg", ".jpeg")):
             image_path = os.path.join(image_folder, filename)
-            annotation_path = os.path.join(
-                annotation_folder, os.path.splitext(filename)[0] + ".txt"
-            )
+            img_name = os.path.splitext(filename)[0]
 
-            if not os.path.exists(annotation_path):
+            if img_name not in annotation_index:
                 print(f"Annotation file not found for {filename}, skipping.")
                 continue
 
@@ -131,24 +113,23 @@ def process_images(
                     original_image, target_size
                 )
                 # Read YOLO annotations and adjust for resized image
-                points = read_yolo_annotations(
-                    annotation_path, original_width, original_height
+                points = annotation_index.points(
+                    img_name, original_width, original_height
                 )
                 # Adjust point coordinates for resized image
                 scale_x = new_width / original_width
                 scale_y = new_height / original_height
-                adjusted_points = [
-                    (int(x * scale_x) + paste_x, int(y * scale_y) + paste_y, c)
-                    for x, y, c in points
-                ]
+                adjusted_points = points.copy()
+                adjusted_points[:, 0] = (points[:, 0] * scale_x).astype(int) + paste_x
+                adjusted_points[:, 1] = (points[:, 1] * scale_y).astype(int) + paste_y
                 # Save resized image
                 resized_image_path = os.path.join(output_image_folder, filename)
                 resized_image.save(resized_image_path)
                 image_shape = target_size
             else:
                 # Use original image and points if resize is False
-                adjusted_points = read_yolo_annotations(
-                    annotation_path, original_width, original_height
+                adjusted_points = annotation_index.points(
+                    img_name, original_width, original_height
                 )
                 # Copy original image to output folder
                 original_image_path = os.path.join(output_image_folder, filename)
@@ -228,6 +209,8 @@ if __name__ == "__main__":
 
         image_folder = f"../datasets/corn_kernel_yolo/images/{stub}/"
         annotation_folder = f"../datasets/corn_kernel_yolo/labels/{stub}/"
+        # Compiled from the label files on first use, None for the default
+        index_dir = None
 
         class_labels = [0]  # 0 for kernel
 
@@ -240,6 +223,7 @@ if __name__ == "__main__":
             resize,
             target_size,
             sigma,
+            index_dir,
         )
 
         # Visualize the density map for a sample (first) image in the dataset
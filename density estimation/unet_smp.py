@@ -1,5 +1,9 @@
+import json
 import os
 import random
+import re
+import time
+import warnings
 
 import lightning as L
 import matplotlib.pyplot as plt
@@ -48,13 +52,19 @@ class DensityLoss(nn.Module):
 
 class UNetLightningModule(L.LightningModule):
     def __init__(
-        self, in_channels, out_channels, decoder_channels, learning_rate, loss_fn="mse"
+        self,
+        in_channels,
+        out_channels,
+        decoder_channels,
+        learning_rate,
+        loss_fn="mse",
+        encoder_weights="imagenet",
     ):
         super().__init__()
         self.learning_rate = learning_rate
         model = smp.Unet(
             encoder_name="efficientnet-b1",  # choose encoder, e.g. mobilenet_v2 or efficientnet-b7
-            encoder_weights="imagenet",  # use `imagenet` pre-trained weights for encoder initialization
+            encoder_weights=encoder_weights,  # use `imagenet` pre-trained weights for encoder initialization
             decoder_channels=decoder_channels,  # input channels param for convolutions in decoder
             in_channels=in_channels,  # model input channels (1 for grayscale images, 3 for RGB, etc.)
             classes=out_channels,  # model output channels (number of classes)
@@ -353,6 +363,150 @@ class DensityMapVisualizationCallback(Callback):
         plt.close(fig)
 
 
+class StepProfilerCallback(Callback):
+    """
+    Split each training step into data-wait, H2D, forward, backward and
+    optimizer time. The times are logged to TensorBoard and saved, with a
+    summary, as JSON in the log directory of the run.
+
+    Lightning has no hook right after the optimizer step, so the optimizer
+    time runs until this callback's on_train_batch_end and includes the
+    on_train_batch_end of the callbacks listed before it. List it first.
+
+    The timing wrapper is set on the module, so Lightning sees its
+    transfer_batch_to_device as overridden and would warn that it is used
+    instead of the LightningDataModule one. That warning is filtered.
+
+    On GPU, the CUDA stream is synchronized at every phase boundary, which
+    stops the CPU from running ahead of the GPU and slows training down.
+    Only use it for profiling runs.
+    """
+
+    phases = ("data_wait", "h2d", "forward", "backward", "optimizer")
+
+    def __init__(self, filename="step_profile.json", warmup_steps=5):
+        super().__init__()
+        self.filename = filename
+        # Steps left out of the summary (cuDNN autotuning, worker start-up)
+        self.warmup_steps = warmup_steps
+        self.steps = []
+        self._last_end = None
+        self._h2d = None
+        self._start = None
+        self._backward_start = None
+        self._backward_end = None
+
+    def _now(self, pl_module):
+        # Wait for queued CUDA kernels so they count towards the right phase
+        if pl_module.device.type == "cuda":
+            torch.cuda.synchronize(pl_module.device)
+        return time.perf_counter()
+
+    def on_fit_start(self, trainer, pl_module):
+        # Callbacks have no hook around the batch transfer, so time it by
+        # wrapping the module's transfer hook for the duration of the fit
+        transfer_batch_to_device = pl_module.transfer_batch_to_device
+
+        def timed_transfer_batch_to_device(batch, device, dataloader_idx):
+            start = self._now(pl_module)
+            batch = transfer_batch_to_device(batch, device, dataloader_idx)
+            if trainer.training:
+                self._h2d = (start, self._now(pl_module))
+            return batch
+
+        pl_module.transfer_batch_to_device = timed_transfer_batch_to_device
+        warnings.filterwarnings(
+            "ignore",
+            message=re.escape(
+                "You have overridden `transfer_batch_to_device` in `LightningModule`"
+                " but have passed in a `LightningDataModule`"
+            ),
+        )
+
+    def teardown(self, trainer, pl_module, stage):
+        # Also runs after an interrupted or failed fit
+        pl_module.__dict__.pop("transfer_batch_to_device", None)
+
+    def on_exception(self, trainer, pl_module, exception):
+        pl_module.__dict__.pop("transfer_batch_to_device", None)
+
+    def on_train_epoch_start(self, trainer, pl_module):
+        self._last_end = self._now(pl_module)
+
+    def on_validation_end(self, trainer, pl_module):
+        # Do not count validation as waiting for the next training batch
+        self._last_end = self._now(pl_module)
+
+    def on_train_batch_start(self, trainer, pl_module, batch, batch_idx):
+        self._start = self._now(pl_module)
+        self._backward_start = None
+        self._backward_end = None
+
+    def on_before_backward(self, trainer, pl_module, loss):
+        self._backward_start = self._now(pl_module)
+
+    def on_after_backward(self, trainer, pl_module):
+        self._backward_end = self._now(pl_module)
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx):
+        end = self._now(pl_module)
+        if self._backward_end is None:
+            # The training step was skipped (returned None), nothing to split
+            self._last_end = end
+            self._h2d = None
+            return
+
+        h2d_start, h2d_end = self._h2d if self._h2d is not None else (self._start,) * 2
+        times = {
+            "data_wait": h2d_start - self._last_end,
+            "h2d": h2d_end - h2d_start,
+            "forward": self._backward_start - self._start,
+            "backward": self._backward_end - self._backward_start,
+            "optimizer": end - self._backward_end,
+        }
+        step = {"epoch": trainer.current_epoch, "step": trainer.global_step}
+        step.update({f"{phase}_ms": t * 1000 for phase, t in times.items()})
+        step["total_ms"] = (end - self._last_end) * 1000
+        self.steps.append(step)
+        self._last_end = end
+        self._h2d = None
+
+        # The JSON keeps every step, TensorBoard only every log_every_n_steps
+        log_step = trainer.global_step % trainer.log_every_n_steps == 0
+        if log_step and isinstance(trainer.logger, TensorBoardLogger):
+            for key, value in step.items():
+                if key.endswith("_ms"):
+                    trainer.logger.experiment.add_scalar(
+                        f"step_profile/{key}", value, trainer.global_step
+                    )
+
+    def on_train_epoch_end(self, trainer, pl_module):
+        # Saved every epoch so that interrupted runs keep their profile
+        self.save(trainer)
+
+    def summary(self):
+        steps = self.steps[self.warmup_steps :]
+        if not steps:
+            return {}
+        total = np.array([step["total_ms"] for step in steps])
+        summary = {}
+        for key in [f"{phase}_ms" for phase in self.phases] + ["total_ms"]:
+            values = np.array([step[key] for step in steps])
+            summary[key] = {
+                "mean": float(values.mean()),
+                "p50": float(np.percentile(values, 50)),
+                "p90": float(np.percentile(values, 90)),
+                "share": float(values.sum() / total.sum()),
+            }
+        return summary
+
+    def save(self, trainer):
+        log_dir = trainer.log_dir or trainer.default_root_dir
+        os.makedirs(log_dir, exist_ok=True)
+        with open(os.path.join(log_dir, self.filename), "w") as f:
+            json.dump({"summary": self.summary(), "steps": self.steps}, f, indent=2)
+
+
 if __name__ == "__main__":
     root_dir = "../"
     # Define hyperparameters
@@ -368,6 +522,7 @@ if __name__ == "__main__":
         "num_workers": 1,
         # Training hyperparameters
         "max_epochs": 300,
+        "profile_steps": False,
         # Paths
         "train_image_dir": f"{root_dir}datasets/corn_kernel_density/train/original_size_dmx100/sigma-12",
         "train_density_map_dir": f"{root_dir}datasets/corn_kernel_density/train/original_size_dmx100/sigma-12",
@@ -419,6 +574,12 @@ if __name__ == "__main__":
         monitor="val_mse_loss",
     )
 
+    callbacks = [progress_bar, visualization_callback, checkpoint_callback]
+    if hparams["profile_steps"]:
+        # Split training steps into phases, saves step_profile.json in the
+        # log dir. Slows training down, so only for profiling runs
+        callbacks.insert(0, StepProfilerCallback())
+
     # checkpoint_callback.best_model_path
     logger = TensorBoardLogger(f"{root_dir}logs/tb_logs", name="unet_smp")
     logger.log_hyperparams(hparams)
@@ -427,7 +588,7 @@ if __name__ == "__main__":
     trainer = L.Trainer(
         max_epochs=hparams["max_epochs"],
         accelerator="gpu",
-        callbacks=[progress_bar, visualization_callback, checkpoint_callback],
+        callbacks=callbacks,
         logger=logger,
     )
 